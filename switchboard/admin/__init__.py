@@ -15,7 +15,7 @@ import datastore.core
 from webob.exc import HTTPNotFound
 
 from .. import operator, signals
-from ..models import Switch
+from ..models import LazyDatastore, Switch
 from .utils import (
     json_api,
     SwitchboardException,
@@ -48,7 +48,10 @@ def index():
     switches.sort(key=attrgetter(sort_by), reverse=reverse)
 
     messages = []
-    if isinstance(Switch.ds, datastore.DictDatastore):
+    ds = Switch.ds
+    if isinstance(ds, LazyDatastore):
+        ds = ds.resolve()
+    if isinstance(ds, datastore.DictDatastore):
         m = dict(status='warning',
                  message='An in-memory datastore is being used; no changes \
                           will persist after a server restart.')
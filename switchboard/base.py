@@ -41,14 +41,20 @@ class ModelDict(threading.local):
         self._auto_create = auto_create
 
     def __getitem__(self, key):
-        if self._auto_create:
-            instance = self._model.get_or_create(key)[0]
-        else:
-            instance = self._model.get(key)
+        instance = self._lookup(key)
         if instance is None:
             raise KeyError(key)
         return instance
 
+    def _lookup(self, key):
+        '''
+        Returns the instance for key, or None if it doesn't exist. Lets hot
+        paths handle a miss without raising and catching a KeyError.
+        '''
+        if self._auto_create:
+            return self._model.get_or_create(key)[0]
+        return self._model.get(key)
+
     def __setitem__(self, key, instance):
         if not hasattr(instance, 'key'):
             instance.key = key
@@ -91,11 +97,8 @@ class ModelDict(threading.local):
         return list(self.iteritems())
 
     def get(self, key, default=None):
-        try:
-            value = self[key]
-        except KeyError:
-            value = default
-        return value
+        instance = self._lookup(key)
+        return default if instance is None else instance
 
     def pop(self, key, default=None):
         value = self.get(key, default)
@@ -0,0 +1,95 @@
+"""
+switchboard.cache
+~~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+_MISSING = object()
+
+
+class TTLCache(object):
+    """
+    A small, thread-safe mapping whose entries expire ``ttl`` seconds after
+    they were stored. Expired entries are dropped as new ones are stored, and
+    once ``maxsize`` entries are held, the oldest entry is evicted to make
+    room for a new one.
+
+    A ``ttl`` or ``maxsize`` of zero disables the cache: nothing is stored and
+    every lookup misses.
+
+    ``generation`` changes whenever the cache is cleared. A caller computing
+    a value to store can read it first and pass it to :meth:`set`, so that a
+    value computed before a clear isn't stored after it.
+
+    >>> cache = TTLCache(maxsize=100, ttl=3) #doctest: +SKIP
+    >>> cache.set('key', True) #doctest: +SKIP
+    >>> cache.get('key') #doctest: +SKIP
+    True
+    """
+    def __init__(self, maxsize=0, ttl=0, timer=time.time):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer = timer
+        self.generation = 0
+        self.configure(maxsize, ttl)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def configure(self, maxsize, ttl):
+        """
+        Resizes the cache and sets a new expiry; existing entries are dropped.
+        """
+        with self._lock:
+            self.maxsize = int(maxsize)
+            self.ttl = float(ttl)
+            self._data.clear()
+            self.generation += 1
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expires, value = item
+        if expires < self._timer():
+            with self._lock:
+                # Another thread may have already replaced or removed it.
+                if self._data.get(key) is item:
+                    del self._data[key]
+            return default
+        return value
+
+    def set(self, key, value, generation=None):
+        if not self.enabled:
+            return
+        now = self._timer()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # Cleared since the value was computed; it may be stale.
+                return
+            self._data.pop(key, None)
+            # The TTL is fixed between configure() calls, so entries are held
+            # in expiry order and the expired ones are all at the front.
+            while self._data:
+                oldest = next(iter(self._data))
+                if self._data[oldest][0] >= now:
+                    break
+                del self._data[oldest]
+            while len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+            self._data[key] = (now + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
@@ -6,10 +6,20 @@ switchboard.manager
 :license: Apache License 2.0, see LICENSE for more details.
 """
 
+from collections import namedtuple
 import logging
+import sys
+import threading
+import time
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: nocover
+    from collections import Mapping
 
 from .base import ModelDict
+from .cache import TTLCache
 from .models import (
+    LazyDatastore,
     Switch,
     DISABLED, SELECTIVE, GLOBAL, INHERIT,
     INCLUDE, EXCLUDE,
@@ -17,26 +27,219 @@ from .models import (
 from .proxy import SwitchProxy
 from .settings import settings, Settings
 
+try:
+    text_type = unicode
+except NameError:  # pragma: nocover
+    text_type = str
+
 log = logging.getLogger(__name__)
-# These are (mostly) read-only module variables since we want it shared among
-# any and all threads. The only exception to read-only is when they are
-# populated on Switchboard startup (i.e., operator.register()).
-registry = {}
-registry_by_namespace = {}
+# The registry is shared among any and all threads. It's read on every
+# is_active call but only written on Switchboard startup (i.e.,
+# operator.register()), so writers publish a fresh snapshot and readers take
+# whichever snapshot is current without locking. The snapshot dicts are never
+# mutated once published.
+_RegistrySnapshot = namedtuple('_RegistrySnapshot', 'by_id by_namespace')
+_registry_ref = [_RegistrySnapshot({}, {})]
+_registry_lock = threading.Lock()
+# The get_all_conditions() result, along with the snapshot it was built from.
+_all_conditions_ref = [(None, [])]
+
+
+class _RegistryView(Mapping):
+    '''
+    Read-only view onto one half of the current registry snapshot.
+    '''
+    def __init__(self, field):
+        self._field = field
+
+    def _current(self):
+        return getattr(_registry_ref[0], self._field)
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __contains__(self, key):
+        return key in self._current()
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+    def __repr__(self):  # pragma: nocover
+        return repr(self._current())
+
+
+registry = _RegistryView('by_id')
+registry_by_namespace = _RegistryView('by_namespace')
+# Shared across threads as well; holds recent is_active results. Disabled
+# unless SWITCHBOARD_EVAL_CACHE_TTL is set.
+_eval_cache = TTLCache()
+_MISSING = object()
+
+
+class _StaticResults(object):
+    '''
+    A key -> bool map for the switches whose result doesn't depend on the
+    instances or context. It's built by configure() and after each local save
+    or delete, and reloaded once it's ``ttl`` seconds old so that changes
+    made by other processes are seen. A ``ttl`` of zero disables it.
+    '''
+    def __init__(self, timer=time.time):
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.configure(0)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.supported
+
+    def configure(self, ttl):
+        self.ttl = float(ttl)
+        self.supported = True
+        self._results = {}
+        self._expires = 0
+
+    def get(self):
+        '''
+        Returns the current map. If it's due to be reloaded, the calling
+        thread reloads it, unless another thread is already doing so.
+        '''
+        if not self.enabled:
+            return {}
+        if self._expires < self._timer() and self._lock.acquire(False):
+            try:
+                if self._expires < self._timer():
+                    self._load()
+            finally:
+                self._lock.release()
+        return self._results
+
+    def rebuild(self):
+        '''
+        Reloads the map now, after any reload that's already under way.
+        '''
+        if not self.enabled:
+            return
+        # Until the reload is done, checks go to the datastore rather than
+        # use results the caller may just have changed.
+        self._results = {}
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        try:
+            results = _load_static_results()
+        except NotImplementedError:
+            # The datastore can't list its switches, and never will.
+            log.warning('Switches can\'t be listed from the datastore; '
+                        'not precomputing static switch results')
+            self.supported = False
+            results = {}
+        except Exception:
+            # Keep the empty map until the next reload is due, so a failing
+            # datastore isn't scanned (and logged) on every check.
+            log.exception('Error loading static switch results')
+            results = {}
+        self._results = results
+        self._expires = self._timer() + self.ttl
+
+
+# Shared across threads; only consulted while the eval cache is enabled.
+_static_results = _StaticResults()
+
+
+def _configure_eval_cache():
+    _eval_cache.configure(
+        maxsize=getattr(settings, 'SWITCHBOARD_EVAL_CACHE_SIZE', 50000),
+        ttl=getattr(settings, 'SWITCHBOARD_EVAL_CACHE_TTL', 0),
+    )
+    ttl = getattr(settings, 'SWITCHBOARD_STATIC_RESULTS_TTL', 60)
+    _static_results.configure(ttl if _eval_cache.enabled else 0)
+
+
+def clear_eval_cache(sender=None):
+    '''
+    Drops every cached is_active result and rebuilds the static results;
+    connected to the model save and delete signals so that local writes are
+    visible immediately.
+    '''
+    _eval_cache.clear()
+    _static_results.rebuild()
+
+
+def _fingerprint(obj):
+    '''
+    Returns a cache key for an object passed to is_active, or None if checks
+    involving it shouldn't be cached. Hashable objects are keyed by type and
+    value, so equal objects share cached results. Unhashable objects, and
+    objects hashed on their identity (such as a new request for every call),
+    get None: their results would never be looked up again, and the cache
+    would keep the objects alive until the entries expired.
+    '''
+    cls = getattr(obj, '__class__', type(obj))
+    hash_method = getattr(cls, '__hash__', None)
+    if hash_method is None or hash_method is object.__hash__:
+        return None
+    try:
+        hash(obj)
+    except TypeError:
+        return None
+    return (type(obj), obj)
+
+
+def _static_result(switches, key):
+    '''
+    Given a map of every switch, returns the result of checking ``key`` if it
+    can be known without any instances or context; otherwise returns None.
+    '''
+    parts = key.split(':')
+    result = None
+    dynamic = False
+    for i in range(1, len(parts) + 1):
+        switch = switches.get(':'.join(parts[:i]))
+        if switch is None:
+            # A missing parent may be auto-created on lookup.
+            dynamic = True
+        elif switch.status == DISABLED:
+            return False
+        elif switch.status == GLOBAL:
+            result = True
+        elif switch.status != INHERIT and switch.value:
+            dynamic = True
+    # A result of None here depends on the caller's default.
+    return None if dynamic else result
+
+
+def _load_static_results():
+    '''
+    Reads every switch from the datastore and returns the results that can
+    be known without any instances or context.
+    '''
+    switches = dict((s.key, s) for s in Switch.all())
+    results = {}
+    for key in switches:
+        result = _static_result(switches, key)
+        if result is not None:
+            results[key] = result
+    return results
 
 
 def nested_config(config):
-    cfg = {}
     token = 'switchboard.'
-    for k, v in config.iteritems():
-        if k.startswith(token):
-            cfg[k.replace(token, '')] = v
-    return cfg
+    # Slice the prefix off rather than replacing it, so a later occurrence of
+    # the token within the key is kept.
+    return dict((k[len(token):], v) for k, v in config.items()
+                if k.startswith(token))
 
 
 def configure(config={}, datastore=None, nested=False):
     """
     Useful for when you need to control Switchboard's setup
+
+    ``datastore`` may be a datastore, or a callable that returns one; a
+    callable isn't invoked until a switch is first read or written.
     """
     if nested:
         config = nested_config(config)
@@ -45,10 +248,23 @@ def configure(config={}, datastore=None, nested=False):
     Settings.init(**config)
 
     if datastore:
+        if callable(datastore):
+            datastore = LazyDatastore(datastore)
         Switch.ds = datastore
 
-    # Register the builtins
-    __import__('switchboard.builtins')
+    global auto_create
+    auto_create = getattr(settings, 'SWITCHBOARD_AUTO_CREATE', True)
+
+    _configure_eval_cache()
+    # A lazy datastore isn't built until it's needed, so its map is left for
+    # the first check to load.
+    if not isinstance(Switch.ds, LazyDatastore):
+        _static_results.rebuild()
+
+    # Register the builtins. They import the operator from this package, so
+    # this can't be a module-level import; only the first call loads them.
+    if 'switchboard.builtins' not in sys.modules:
+        from . import builtins  # noqa
 
 
 class SwitchManager(ModelDict):
@@ -72,6 +288,19 @@ class SwitchManager(ModelDict):
         self.context = {}
         super(SwitchManager, self).__init__(*new_args, **kwargs)
 
+    @property
+    def _auto_create(self):
+        # auto_create=None follows the SWITCHBOARD_AUTO_CREATE setting. It's
+        # read from the module, rather than copied into this thread-local
+        # instance, so that configure() changes it for every thread.
+        if self._auto_create_value is None:
+            return auto_create
+        return self._auto_create_value
+
+    @_auto_create.setter
+    def _auto_create(self, value):
+        self._auto_create_value = value
+
     def __unicode__(self):  # pragma: nocover
         return "<%s: %s (%s)>" % (self.__class__.__name__,
                                   getattr(self, 'model', ''),
@@ -85,6 +314,10 @@ class SwitchManager(ModelDict):
         """
         return SwitchProxy(self, super(SwitchManager, self).__getitem__(key))
 
+    def get(self, key, default=None):
+        switch = self._lookup(key)
+        return default if switch is None else SwitchProxy(self, switch)
+
     def with_result_cache(func):
         """
         Decorator specifically for is_active.  If self.result_cache is set to a {}
@@ -110,7 +343,45 @@ class SwitchManager(ModelDict):
             return result
         return inner
 
+    def with_eval_cache(func):
+        """
+        Decorator specifically for is_active. Results are shared across
+        threads in a TTL cache, keyed on the switch key, the instances and
+        context objects, and any keyword arguments. Checks involving an
+        object that can't be fingerprinted, or an unhashable keyword
+        argument, are never cached.
+
+        Switches that are globally active or disabled, all the way up their
+        parent chain, are answered from a precomputed map instead.
+        """
+        def inner(self, key, *instances, **kwargs):
+            if not _eval_cache.enabled:
+                return func(self, key, *instances, **kwargs)
+            result = _static_results.get().get(key)
+            if result is not None:
+                return result
+            instance_keys = tuple(_fingerprint(i) for i in instances)
+            context_keys = tuple((k, _fingerprint(v))
+                                 for k, v in sorted(self.context.items()))
+            if (any(k is None for k in instance_keys) or
+                    any(k is None for _, k in context_keys)):
+                return func(self, key, *instances, **kwargs)
+            cache_key = (key, instance_keys, context_keys,
+                         tuple(sorted(kwargs.items())))
+            try:
+                result = _eval_cache.get(cache_key, _MISSING)
+            except TypeError:  # not hashable
+                return func(self, key, *instances, **kwargs)
+            if result is _MISSING:
+                generation = _eval_cache.generation
+                result = func(self, key, *instances, **kwargs)
+                _eval_cache.set(cache_key, result, generation)
+            return result
+        return inner
+
+
     @with_result_cache
+    @with_eval_cache
     def is_active(self, key, *instances, **kwargs):
         """
         Returns ``True`` if any of ``instances`` match an active switch.
@@ -118,63 +389,97 @@ class SwitchManager(ModelDict):
 
         >>> operator.is_active('my_feature', request) #doctest: +SKIP
         """
-        try:
-            default = kwargs.pop('default', False)
-
-            # Check all parents for a disabled state
-            parts = key.split(':')
-            if len(parts) > 1:
-                child_kwargs = kwargs.copy()
-                child_kwargs['default'] = None
-                result = self.is_active(':'.join(parts[:-1]), *instances,
-                                        **child_kwargs)
-
-                if result is False:
-                    return result
-                elif result is True:
-                    default = result
+        return self._is_active_impl(key, instances,
+                                    kwargs.pop('default', False))
 
+    def _is_active_impl(self, key, instances, default):
+        """
+        Does the work for is_active, taking ``instances`` as a tuple and
+        ``default`` as a plain argument.
+        """
+        # Walk from the root of the key down to the key itself. A parent
+        # that isn't active disables all of its children, while an active
+        # parent becomes the default for its children.
+        inherited = False
+        context_instances = None
+        path = None
+        for part in key.split(':'):
+            path = part if path is None else path + ':' + part
             try:
-                switch = self[key]
-            except KeyError:
+                # Only status and value are read, so skip the SwitchProxy.
+                switch = self._lookup(path)
+            except Exception:
+                log.exception('Error checking if switch "%s" is active', key)
+                return False
+            if switch is None:
                 # switch is not defined, defer to parent
-                return default
+                continue
 
-            if switch.status == GLOBAL:
-                return True
-            elif switch.status == DISABLED:
+            status = switch.status
+            if status == GLOBAL:
+                inherited = True
+                continue
+            elif status == DISABLED:
                 return False
-            elif switch.status == INHERIT:
-                return default
+            elif status == INHERIT:
+                continue
 
             conditions = switch.value
             # If no conditions are set, we inherit from parents
             if not conditions:
-                return default
-
-            instances = list(instances) if instances else []
-            instances.extend(self.context.values())
-
-            # check each switch to see if it can execute
-            return_value = False
-
-            for namespace, condition in conditions.iteritems():
-                condition_set = registry_by_namespace.get(namespace)
-                if not condition_set:
-                    continue
-                result = condition_set.has_active_condition(condition,
-                                                            instances)
-                if result is False:
-                    return False
-                elif result is True:
-                    return_value = True
-        except:
-            log.exception('Error checking if switch "%s" is active', key)
-            return_value = False
+                continue
+
+            if context_instances is None:
+                context_instances = list(instances)
+                context_instances.extend(self.context.values())
+            if not self._check_conditions(key, conditions,
+                                          context_instances):
+                return False
+            inherited = True
+
+        return inherited or default
+
+    def _check_conditions(self, key, conditions, instances):
+        """
+        Returns ``True`` if the instances match the given switch conditions.
+        ``key`` is the switch being checked, for logging errors.
+        """
+        by_namespace = _registry_ref[0].by_namespace
+        if len(conditions) == 1:
+            # Most switches only use a single condition set.
+            (namespace, condition), = conditions.items()
+            condition_set = by_namespace.get(namespace)
+            if not condition_set:
+                return False
+            return self._has_active_condition(key, condition_set, condition,
+                                              instances) is True
+
+        # check each switch to see if it can execute
+        return_value = False
+
+        for namespace, condition in conditions.items():
+            condition_set = by_namespace.get(namespace)
+            if not condition_set:
+                continue
+            result = self._has_active_condition(key, condition_set,
+                                                condition, instances)
+            if result is False:
+                return False
+            elif result is True:
+                return_value = True
 
         # there were no matching conditions, so it must not be enabled
         return return_value
 
+    def _has_active_condition(self, key, condition_set, condition,
+                              instances):
+        # Condition sets are user code, so guard against them failing.
+        try:
+            return condition_set.has_active_condition(condition, instances)
+        except Exception:
+            log.exception('Error checking if switch "%s" is active', key)
+            return False
+
     def register(self, condition_set):
         """
         Registers a condition set with the manager.
@@ -185,8 +490,13 @@ class SwitchManager(ModelDict):
 
         if callable(condition_set):
             condition_set = condition_set()
-        registry[condition_set.get_id()] = condition_set
-        registry_by_namespace[condition_set.get_namespace()] = condition_set
+        with _registry_lock:
+            current = _registry_ref[0]
+            by_id = dict(current.by_id)
+            by_id[condition_set.get_id()] = condition_set
+            by_namespace = dict(current.by_namespace)
+            by_namespace[condition_set.get_namespace()] = condition_set
+            _registry_ref[0] = _RegistrySnapshot(by_id, by_namespace)
 
     def unregister(self, condition_set):
         """
@@ -196,22 +506,27 @@ class SwitchManager(ModelDict):
         """
         if callable(condition_set):
             condition_set = condition_set()
-        registry.pop(condition_set.get_id(), None)
-        registry_by_namespace.pop(condition_set.get_namespace(), None)
+        with _registry_lock:
+            current = _registry_ref[0]
+            by_id = dict(current.by_id)
+            by_id.pop(condition_set.get_id(), None)
+            by_namespace = dict(current.by_namespace)
+            by_namespace.pop(condition_set.get_namespace(), None)
+            _registry_ref[0] = _RegistrySnapshot(by_id, by_namespace)
 
     def get_condition_set_by_id(self, switch_id):
         """
         Given the identifier of a condition set (described in
         ConditionSet.get_id()), returns the registered instance.
         """
-        return registry[switch_id]
+        return _registry_ref[0].by_id[switch_id]
 
     def get_condition_sets(self):
         """
         Returns a generator yielding all currently registered
         ConditionSet instances.
         """
-        return registry.itervalues()
+        return iter(_registry_ref[0].by_id.values())
 
     def get_all_conditions(self):
         """
@@ -220,12 +535,24 @@ class SwitchManager(ModelDict):
         >>> for set_id, label, field in operator.get_all_conditions(): #doctest: +SKIP
         >>>     print "%(label)s: %(field)s" % (label, field.label) #doctest: +SKIP
         """
-        cs = self.get_condition_sets()
-        for condition_set in sorted(cs, key=lambda x: x.get_group_label()):
-            group = unicode(condition_set.get_group_label())
-            for field in condition_set.fields.itervalues():
-                yield condition_set.get_id(), group, field
-
+        snapshot = _registry_ref[0]
+        cached_snapshot, conditions = _all_conditions_ref[0]
+        if cached_snapshot is not snapshot:
+            # The registry changed since the list was last built.
+            conditions = []
+            cs = snapshot.by_id.values()
+            for condition_set in sorted(cs,
+                                        key=lambda x: x.get_group_label()):
+                group = text_type(condition_set.get_group_label())
+                for field in condition_set.fields.values():
+                    conditions.append((condition_set.get_id(), group, field))
+            _all_conditions_ref[0] = (snapshot, conditions)
+        return iter(conditions)
+
+
+Switch.post_save.connect(clear_eval_cache)
+Switch.post_delete.connect(clear_eval_cache)
+_configure_eval_cache()
 
 auto_create = getattr(settings, 'SWITCHBOARD_AUTO_CREATE', True)
-operator = SwitchManager(auto_create=auto_create)
+operator = SwitchManager(auto_create=None)
@@ -9,6 +9,7 @@ switchboard.models
 from datetime import datetime
 import logging
 import os
+import threading
 import uuid
 
 from blinker import signal
@@ -43,6 +44,35 @@ def _key(key=''):
     return key
 
 
+class LazyDatastore(object):
+    '''
+    Stands in for a datastore that is built by calling ``factory`` the first
+    time it's used, so connecting to the backend doesn't hold up startup.
+    '''
+    def __init__(self, factory):
+        self._factory = factory
+        self._datastore = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        '''
+        Returns the datastore, building it if it hasn't been built yet.
+        '''
+        ds = self._datastore
+        if ds is None:
+            with self._lock:
+                if self._datastore is None:
+                    self._datastore = self._factory()
+                ds = self._datastore
+        return ds
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __len__(self):
+        return len(self.resolve())
+
+
 class Model(object):
     '''
     Basic data object for CRUD operations on top of a datastore.
@@ -64,7 +94,8 @@ class Model(object):
 
     def save(self):
         # A little odd, but we need to see if a previous model has been
-        # saved, e.g., in the case of an update operation.
+        # saved, e.g., in the case of an update operation. That costs an
+        # extra datastore read, so skip it when nothing listens to pre_save.
         try:
             key = _key(self.key)
         except AttributeError:
@@ -72,7 +103,7 @@ class Model(object):
             key = _key(self.key)
             previous = None
         else:
-            previous = self.get(key)
+            previous = self.get(key) if self.pre_save.receivers else None
         self.pre_save.send(previous)
         self.ds.put(key, self.__dict__)
         self.post_save.send(self)
@@ -182,12 +213,13 @@ class Model(object):
         if hasattr(cls.ds, '_redis'):
             r = cls.ds._redis
             keys = r.keys()
+            if not keys:
+                return []
             serializer = cls.ds.child_datastore.serializer
-
-            def get_value(k):
-                value = r.get(k)
-                return value if value is None else serializer.loads(value)
-            return [get_value(k) for k in keys]
+            # Fetch every value in a single round trip; a key deleted since
+            # the keys() call comes back as None and is skipped.
+            return [serializer.loads(value) for value in r.mget(keys)
+                    if value is not None]
         else:
             raise NotImplementedError
 
@@ -230,11 +262,13 @@ class Switch(Model):
     }
 
     def __init__(self, *args, **kwargs):
+        # Only new switches lack a status; check that before paying for the
+        # settings lookup, since every switch loaded from the datastore passes
+        # through here.
         if (
-            kwargs and
-            hasattr(settings, 'SWITCHBOARD_SWITCH_DEFAULTS') and
             'key' in kwargs and
-            'status' not in kwargs
+            'status' not in kwargs and
+            hasattr(settings, 'SWITCHBOARD_SWITCH_DEFAULTS')
         ):
             key = kwargs['key']
             switch_default = settings.SWITCHBOARD_SWITCH_DEFAULTS.get(key)
@@ -7,18 +7,29 @@ switchboard.proxy
 """
 
 class SwitchProxy(object):
+    # A proxy is created on every manager lookup; slots avoid allocating a
+    # __dict__ for each one.
+    __slots__ = ('_switch', '_manager')
+
     def __init__(self, manager, switch):
         self._switch = switch
         self._manager = manager
 
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return self.__dict__[attr]
-        else:
-            return getattr(self._switch, attr)
+        if attr in self.__slots__ or attr.startswith('__'):
+            # Unset slots (e.g., while copying) and special methods belong to
+            # the proxy itself, not the switch.
+            raise AttributeError(attr)
+        return getattr(self._switch, attr)
+
+    def __getstate__(self):
+        return (self._manager, self._switch)
+
+    def __setstate__(self, state):
+        self._manager, self._switch = state
 
     def __setattr__(self, attr, value):
-        if attr in ('_switch', '_manager'):
+        if attr in self.__slots__:
             object.__setattr__(self, attr, value)
         else:
             setattr(self._switch, attr, value)
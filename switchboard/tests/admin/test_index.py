@@ -0,0 +1,36 @@
+"""
+switchboard.tests.admin.test_index
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+import bottle
+import datastore
+from nose.tools import assert_true, assert_false
+
+from switchboard.admin import index
+from switchboard.models import LazyDatastore, Switch
+
+
+class TestIndex(object):
+
+    def setup(self):
+        self.original = Switch.ds
+        bottle.request.bind({'QUERY_STRING': ''})
+
+    def teardown(self):
+        Switch.ds = self.original
+
+    def test_in_memory_warning(self):
+        Switch.ds = datastore.DictDatastore()
+        assert_true('in-memory datastore' in index())
+
+    def test_in_memory_warning_lazy(self):
+        Switch.ds = LazyDatastore(datastore.DictDatastore)
+        assert_true('in-memory datastore' in index())
+
+    def test_no_warning(self):
+        Switch.ds = LazyDatastore(datastore.NullDatastore)
+        assert_false('in-memory datastore' in index())
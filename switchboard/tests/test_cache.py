@@ -0,0 +1,92 @@
+"""
+switchboard.tests.test_cache
+~~~~~~~~~~~~~~~
+
+:copyright: (c) 2015 Kyle Adams.
+:license: Apache License 2.0, see LICENSE for more details.
+"""
+
+from nose.tools import (
+    assert_equals,
+    assert_true,
+    assert_false,
+)
+
+from ..cache import TTLCache
+
+
+class TestTTLCache(object):
+
+    def setup(self):
+        self.now = 1000.0
+        self.cache = TTLCache(maxsize=2, ttl=3, timer=lambda: self.now)
+
+    def test_get_set(self):
+        assert_equals(self.cache.get('a'), None)
+        self.cache.set('a', False)
+        assert_false(self.cache.get('a', True))
+
+    def test_expiration(self):
+        self.cache.set('a', True)
+        self.now += 2
+        assert_true(self.cache.get('a'))
+        self.now += 2
+        assert_equals(self.cache.get('a'), None)
+        assert_equals(len(self.cache), 0)
+
+    def test_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        assert_equals(len(self.cache), 2)
+        assert_equals(self.cache.get('a'), None)
+        assert_equals(self.cache.get('b'), 2)
+        assert_equals(self.cache.get('c'), 3)
+
+    def test_clear(self):
+        self.cache.set('a', 1)
+        self.cache.clear()
+        assert_equals(self.cache.get('a'), None)
+
+    def test_disabled(self):
+        cache = TTLCache()
+        assert_false(cache.enabled)
+        cache.set('a', 1)
+        assert_equals(cache.get('a'), None)
+
+    def test_configure(self):
+        self.cache.set('a', 1)
+        self.cache.configure(maxsize='10', ttl='0.5')
+        assert_equals(self.cache.maxsize, 10)
+        assert_equals(self.cache.ttl, 0.5)
+        assert_equals(self.cache.get('a'), None)
+
+    def test_generation(self):
+        generation = self.cache.generation
+        self.cache.clear()
+        assert_true(self.cache.generation != generation)
+        # A value computed before the clear isn't stored.
+        self.cache.set('a', 1, generation)
+        assert_equals(self.cache.get('a'), None)
+        self.cache.set('a', 1, self.cache.generation)
+        assert_equals(self.cache.get('a'), 1)
+
+    def test_configure_bumps_generation(self):
+        generation = self.cache.generation
+        self.cache.configure(maxsize=2, ttl=3)
+        assert_true(self.cache.generation != generation)
+
+    def test_set_purges_expired(self):
+        cache = TTLCache(maxsize=100, ttl=3, timer=lambda: self.now)
+        for key in range(10):
+            cache.set(key, True)
+        assert_equals(len(cache), 10)
+        self.now += 2
+        cache.set('a', 1)
+        assert_equals(len(cache), 11)
+        self.now += 2
+        # The first ten have expired and are dropped without being looked up.
+        cache.set('b', 2)
+        assert_equals(len(cache), 2)
+        assert_equals(cache.get('a'), 1)
+        assert_equals(cache.get('b'), 2)
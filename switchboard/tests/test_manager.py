@@ -5,10 +5,14 @@ switchboard.tests.test_manager
 :copyright: (c) 2015 Kyle Adams.
 :license: Apache License 2.0, see LICENSE for more details.
 """
+import copy
 import threading
+import weakref
 
+import datastore
 from nose.tools import (
     assert_equals,
+    assert_not_equals,
     assert_true,
     assert_false,
     assert_raises
@@ -17,7 +21,7 @@ from mock import Mock, patch
 from webob import Request
 from webob.exc import HTTPNotFound, HTTPFound
 
-from .. import configure
+from .. import configure, manager, operator
 from ..builtins import (
     IPAddressConditionSet,
     HostConditionSet,
@@ -25,11 +29,21 @@ from ..builtins import (
 )
 from ..decorators import switch_is_active
 from ..models import (
+    LazyDatastore,
     Switch,
     SELECTIVE, DISABLED, GLOBAL, INHERIT,
     INCLUDE, EXCLUDE
 )
-from ..manager import registry, SwitchManager
+from ..manager import (
+    registry,
+    nested_config,
+    SwitchManager,
+    _eval_cache,
+    _fingerprint,
+    _load_static_results,
+    _static_results,
+)
+from ..proxy import SwitchProxy
 from ..settings import settings
 
 
@@ -69,18 +83,50 @@ class TestAPI(object):
         assert_equals(len(list(self.operator.get_condition_sets())), 2,
                       self.operator)
 
+    def test_registry_snapshot(self):
+        # Iteration isn't disturbed by a concurrent unregister.
+        condition_sets = self.operator.get_condition_sets()
+        self.operator.unregister(QueryStringConditionSet)
+        assert_equals(len(list(condition_sets)), 3)
+        assert_equals(len(list(self.operator.get_condition_sets())), 2)
+
+    def test_registry_read_only(self):
+        with assert_raises(TypeError):
+            registry['foo'] = 'bar'
+
     def test_get_all_conditions(self):
         conditions = list(self.operator.get_all_conditions())
         assert_equals(len(conditions), 5)
         for set_id, label, field in conditions:
             assert_true(set_id in registry)
 
-    @patch('switchboard.base.ModelDict.__getitem__')
-    def test_error(self, getitem):
+    def test_get_all_conditions_cached(self):
+        conditions = list(self.operator.get_all_conditions())
+        with patch.object(HostConditionSet, 'get_group_label') as label:
+            assert_equals(list(self.operator.get_all_conditions()),
+                          conditions)
+            assert_false(label.called)
+        self.operator.unregister(HostConditionSet)
+        assert_equals(len(list(self.operator.get_all_conditions())), 4)
+
+    @patch('switchboard.base.ModelDict._lookup')
+    def test_error(self, lookup):
         # force the is_active call to fail right away
-        getitem.side_effect = Exception('Boom!')
+        lookup.side_effect = Exception('Boom!')
         assert_false(self.operator.is_active('test'))
 
+    def test_condition_error(self):
+        Switch.create(key='test', status=SELECTIVE)
+        self.operator['test'].add_condition(
+            condition_set='switchboard.builtins.IPAddressConditionSet',
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        req = Request.blank('/')
+        with patch.object(IPAddressConditionSet, 'has_active_condition',
+                          side_effect=Exception('Boom!')):
+            assert_false(self.operator.is_active('test', req, default=True))
+
     def test_exclusions(self):
         condition_set = 'switchboard.builtins.IPAddressConditionSet'
 
@@ -258,6 +304,43 @@ class TestAPI(object):
 
         assert_false(self.operator.is_active('test', req))
 
+    def test_get(self):
+        Switch.create(key='test')
+        operator = SwitchManager()
+        assert_true(isinstance(operator.get('test'), SwitchProxy))
+        assert_equals(operator.get('missing', 'default'), 'default')
+
+    def test_is_active_impl(self):
+        Switch.create(key='test', status=INHERIT)
+        operator = SwitchManager()
+        assert_true(operator._is_active_impl('test', (), True))
+        assert_false(operator._is_active_impl('test', (), False))
+        assert_equals(operator._is_active_impl('test:child', (), None), None)
+
+    def test_proxy_copy(self):
+        Switch.create(key='test', status=GLOBAL, label='Test')
+        proxy = self.operator['test']
+        shallow = copy.copy(proxy)
+        assert_true(shallow._switch is proxy._switch)
+        assert_true(shallow._manager is proxy._manager)
+        deep = copy.deepcopy(proxy)
+        assert_true(deep._switch is not proxy._switch)
+        assert_equals(deep.key, 'test')
+        assert_equals(deep.label, 'Test')
+        assert_equals(deep.status, GLOBAL)
+
+    def test_proxy_special_attributes(self):
+        Switch.create(key='test')
+        proxy = self.operator['test']
+        assert_false(hasattr(proxy, '__dict__'))
+        assert_raises(AttributeError, getattr, proxy, '__missing__')
+
+    @patch('switchboard.manager.SwitchProxy')
+    def test_is_active_skips_proxy(self, proxy):
+        Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test'))
+        assert_false(proxy.called)
+
     def test_deletion(self):
         switch = Switch.create(key='test')
 
@@ -485,6 +568,31 @@ class TestAPI(object):
         )
         assert_false(self.operator.is_active('test', req2))
 
+    def test_unregistered_condition_set(self):
+        Switch.create(key='test', status=SELECTIVE,
+                      value={'unregistered': {'foo': [[INCLUDE, '1']]}})
+        req = Request.blank('/')
+        assert_false(self.operator.is_active('test', req, default=True))
+
+    def test_multiple_condition_sets(self):
+        Switch.create(key='test', status=SELECTIVE)
+        switch = self.operator['test']
+        switch.add_condition(
+            condition_set='switchboard.builtins.IPAddressConditionSet',
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        switch.add_condition(
+            condition_set='switchboard.builtins.HostConditionSet',
+            field_name='hostname',
+            condition='nonexistent.example.com',
+        )
+        req = Request.blank('/')
+        req.environ['REMOTE_ADDR'] = '192.168.1.1'
+        assert_true(self.operator.is_active('test', req))
+        req.environ['REMOTE_ADDR'] = '10.1.1.1'
+        assert_false(self.operator.is_active('test', req))
+
     def test_inheritance(self):
         condition_set = 'switchboard.builtins.IPAddressConditionSet'
 
@@ -535,6 +643,20 @@ class TestAPI(object):
         req.environ['REMOTE_ADDR'] = '20.20.20.20'
         assert_true(self.operator.is_active('test:child', req))
 
+    def test_deep_inheritance(self):
+        Switch.create(key='a', status=GLOBAL)
+        Switch.create(key='a:b', status=INHERIT)
+        Switch.create(key='a:b:c:d', status=INHERIT)
+        operator = SwitchManager()
+        assert_true(operator.is_active('a:b:c:d'))
+        assert_true(operator.is_active('a:b:c:d:e'))
+
+        switch = operator['a:b']
+        switch.status = DISABLED
+        switch.save()
+        assert_false(operator.is_active('a:b:c:d', default=True))
+        assert_false(operator.is_active('a:b:c:d:e', default=True))
+
     def test_parent_override_child_state(self):
         Switch.create(
             key='test',
@@ -678,9 +800,9 @@ class TestAPI(object):
 
         assert_false(self.operator.is_active('test:child'))
 
-    @patch('switchboard.base.ModelDict.__getitem__')
-    def test_defaults_on_key_error(self, getitem):
-        getitem.side_effect = KeyError()
+    @patch('switchboard.base.ModelDict._lookup')
+    def test_defaults_on_missing_switch(self, lookup):
+        lookup.return_value = None
         operator = SwitchManager()
         assert_true(operator.is_active('test', default=True))
         assert_false(operator.is_active('test', default=False))
@@ -720,10 +842,63 @@ class TestConfigure(object):
         configure(cfg, nested=True)
         self.assert_settings()
 
+    def test_auto_create(self):
+        try:
+            configure(dict(auto_create=False))
+            assert_false(manager.auto_create)
+            assert_false(operator._auto_create)
+        finally:
+            configure(dict(auto_create=True))
+        assert_true(manager.auto_create)
+        assert_true(operator._auto_create)
+
+    def test_auto_create_other_thread(self):
+        seen = []
+        touched = threading.Event()
+        configured = threading.Event()
+
+        def check():
+            # Touch this thread's copy of the operator before configure().
+            seen.append(operator._auto_create)
+            touched.set()
+            configured.wait()
+            seen.append(operator._auto_create)
+
+        thread = threading.Thread(target=check)
+        thread.start()
+        try:
+            touched.wait()
+            configure(dict(auto_create=False))
+            configured.set()
+            thread.join()
+        finally:
+            configure(dict(auto_create=True))
+        assert_equals(seen, [True, False])
+
+    def test_nested_config(self):
+        cfg = {
+            'switchboard.debug': True,
+            'switchboard.plugin.switchboard.mode': 'x',
+            'foo.switchboard.bar': 'baz',
+        }
+        assert_equals(nested_config(cfg), {
+            'debug': True,
+            'plugin.switchboard.mode': 'x',
+        })
+
     def test_set_datastore(self):
         configure(self.config, datastore='TestDatastore')
         assert_equals(Switch.ds, 'TestDatastore')
 
+    def test_set_datastore_factory(self):
+        factory = Mock()
+        factory.return_value.get.return_value = None
+        configure(self.config, datastore=factory)
+        assert_true(isinstance(Switch.ds, LazyDatastore))
+        assert_false(factory.called)
+        assert_equals(Switch.get('test'), None)
+        assert_true(factory.called)
+
 
 class TestManagerConcurrency(object):
 
@@ -787,6 +962,215 @@ class TestManagerResultCaching(object):
         assert_false(self.operator.is_active('test'))
 
 
+class TestManagerEvalCaching(object):
+
+    def setup(self):
+        self.operator = SwitchManager(auto_create=True)
+        configure(dict(eval_cache_ttl=60))
+
+    def teardown(self):
+        Switch.drop()
+        del settings.SWITCHBOARD_EVAL_CACHE_TTL
+        configure()
+
+    def test_enabled(self):
+        assert_true(_eval_cache.enabled)
+
+    def test_cached(self):
+        Switch.create(key='test', status=SELECTIVE)
+        assert_true(self.operator.is_active('test', default=True))
+        with patch('switchboard.base.ModelDict._lookup') as lookup:
+            assert_true(self.operator.is_active('test', default=True))
+            assert_false(lookup.called)
+
+    def test_invalidated_on_save(self):
+        switch = Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test'))
+        switch.status = DISABLED
+        switch.save()
+        assert_false(self.operator.is_active('test'))
+
+    def test_save_during_evaluation(self):
+        # The missing parent keeps the switch out of the static map.
+        switch = Switch.create(key='parent:test', status=SELECTIVE)
+        operator = SwitchManager()
+        lookup = SwitchManager._lookup
+
+        def save_while_evaluating(manager, path):
+            # Another thread saves after this check has read the switch.
+            instance = lookup(manager, path)
+            if path == 'parent:test':
+                switch.status = GLOBAL
+                switch.save()
+            return instance
+
+        with patch.object(SwitchManager, '_lookup', save_while_evaluating):
+            assert_false(operator.is_active('parent:test'))
+        assert_true(operator.is_active('parent:test'))
+
+    def test_invalidated_on_delete(self):
+        switch = Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test', default=False))
+        switch.delete()
+        operator = SwitchManager()
+        assert_false(operator.is_active('test', default=False))
+
+    def test_keyed_on_instances(self):
+        condition_set = 'switchboard.builtins.IPAddressConditionSet'
+        Switch.create(key='test', status=SELECTIVE)
+        self.operator['test'].add_condition(
+            condition_set=condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        req1 = Request.blank('/')
+        req1.environ['REMOTE_ADDR'] = '192.168.1.1'
+        req2 = Request.blank('/')
+        req2.environ['REMOTE_ADDR'] = '10.1.1.1'
+        assert_true(self.operator.is_active('test', req1))
+        assert_false(self.operator.is_active('test', req2))
+
+    def test_unhashable(self):
+        Switch.create(key='test', status=SELECTIVE)
+        before = len(_eval_cache)
+        assert_false(self.operator.is_active('test', {}))
+        assert_equals(len(_eval_cache), before)
+
+    def test_identity_hashed(self):
+        Switch.create(key='test', status=SELECTIVE)
+        req = Request.blank('/')
+        ref = weakref.ref(req)
+        before = len(_eval_cache)
+        assert_false(self.operator.is_active('test', req))
+        self.operator.context['request'] = req
+        assert_false(self.operator.is_active('test'))
+        self.operator.context.clear()
+        assert_equals(len(_eval_cache), before)
+        # Nothing in the cache keeps the request alive.
+        del req
+        assert_equals(ref(), None)
+
+    def test_unhashable_kwargs(self):
+        Switch.create(key='test', status=SELECTIVE)
+        before = len(_eval_cache)
+        assert_equals(self.operator.is_active('test', default=[]), [])
+        assert_equals(len(_eval_cache), before)
+
+    def test_fingerprint(self):
+        assert_equals(_fingerprint(1), _fingerprint(1))
+        assert_not_equals(_fingerprint(1), _fingerprint(True))
+        assert_equals(_fingerprint({}), None)
+        assert_equals(_fingerprint(([],)), None)
+        assert_equals(_fingerprint(object()), None)
+
+    def test_static_results(self):
+        condition_set = 'switchboard.builtins.IPAddressConditionSet'
+        Switch.create(key='global', status=GLOBAL)
+        Switch.create(key='global:inherit', status=INHERIT)
+        Switch.create(key='global:disabled', status=DISABLED)
+        Switch.create(key='global:selective', status=SELECTIVE)
+        Switch.create(key='disabled', status=DISABLED)
+        Switch.create(key='disabled:global', status=GLOBAL)
+        Switch.create(key='inherit', status=INHERIT)
+        Switch.create(key='selective', status=SELECTIVE)
+        Switch.create(key='selective:global', status=GLOBAL)
+        self.operator['selective'].add_condition(
+            condition_set=condition_set,
+            field_name='ip_address',
+            condition='192.168.1.1',
+        )
+        assert_equals(_load_static_results(), {
+            'global': True,
+            'global:inherit': True,
+            'global:disabled': False,
+            'global:selective': True,
+            'disabled': False,
+            'disabled:global': False,
+        })
+
+    def test_static_results_unsupported(self):
+        class QuerylessDatastore(datastore.DictDatastore):
+            def query(self, query):
+                raise NotImplementedError
+
+        original = Switch.ds
+        Switch.ds = QuerylessDatastore()
+        try:
+            with patch('switchboard.manager.log') as log:
+                Switch.create(key='test', status=GLOBAL)
+                for _ in range(3):
+                    _static_results._expires = 0
+                    assert_true(self.operator.is_active('test'))
+            # Turned off for good, with a single warning.
+            assert_false(_static_results.enabled)
+            assert_equals(log.warning.call_count, 1)
+            assert_false(log.exception.called)
+        finally:
+            Switch.ds = original
+
+    def test_static_results_load_failure(self):
+        Switch.create(key='test', status=GLOBAL)
+        _static_results._expires = 0
+        with patch.object(Switch, 'all', side_effect=RuntimeError):
+            with patch('switchboard.manager.log') as log:
+                for _ in range(3):
+                    assert_true(self.operator.is_active('test'))
+        # The empty map is kept until the next reload is due.
+        assert_equals(log.exception.call_count, 1)
+        assert_true(_static_results.enabled)
+
+    def test_static_results_built_on_configure(self):
+        Switch.create(key='test', status=GLOBAL)
+        configure(dict(eval_cache_ttl=60))
+        with patch.object(Switch, 'all') as all_:
+            assert_true(self.operator.is_active('test'))
+            assert_false(all_.called)
+
+    def test_static_results_lazy_datastore(self):
+        factory = Mock(return_value=datastore.DictDatastore())
+        original = Switch.ds
+        try:
+            configure(dict(eval_cache_ttl=60), datastore=factory)
+            assert_false(factory.called)
+        finally:
+            Switch.ds = original
+
+    def test_static_results_reloaded(self):
+        Switch.create(key='test', status=GLOBAL)
+        with patch.object(Switch, 'all', wraps=Switch.all) as all_:
+            assert_true(self.operator.is_active('test'))
+            assert_false(all_.called)
+            _static_results._expires = 0
+            assert_true(self.operator.is_active('test'))
+            assert_equals(all_.call_count, 1)
+
+    def test_static_results_single_loader(self):
+        Switch.create(key='test', status=GLOBAL)
+        _static_results._expires = 0
+        # While another thread is reloading, use the current map.
+        with _static_results._lock:
+            with patch.object(Switch, 'all') as all_:
+                assert_true(self.operator.is_active('test'))
+                assert_false(all_.called)
+
+    def test_static_results_rebuilt_on_save(self):
+        switch = Switch.create(key='test', status=GLOBAL)
+        assert_true(self.operator.is_active('test'))
+        switch.status = DISABLED
+        switch.save()
+        with patch.object(Switch, 'all') as all_:
+            assert_false(self.operator.is_active('test'))
+            assert_false(all_.called)
+
+    def test_static_results_skip_lookup(self):
+        Switch.create(key='test', status=GLOBAL)
+        req = Request.blank('/')
+        with patch('switchboard.base.ModelDict._lookup') as lookup:
+            assert_true(self.operator.is_active('test', req))
+            assert_true(self.operator.is_active('test', Request.blank('/')))
+            assert_false(lookup.called)
+
+
 class TestManagerResultCacheDecorator(object):
 
     def setup(self):
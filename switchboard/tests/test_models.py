@@ -8,6 +8,8 @@ switchboard.tests.test_models
 import copy
 import pickle
 
+import datastore
+
 from nose.tools import (
     assert_equals,
     assert_true,
@@ -19,6 +21,7 @@ from mock import Mock, patch
 from ..builtins import IPAddressConditionSet
 from ..manager import SwitchManager
 from ..models import (
+    LazyDatastore,
     Model,
     Switch,
     INHERIT, GLOBAL, SELECTIVE, DISABLED,
@@ -77,8 +80,7 @@ class TestModel(object):
         assert_true(post_save.called)
 
     @patch('switchboard.models.Model.post_save.send')
-    @patch('switchboard.models.Model.pre_save.send')
-    def test_save_signals_update(self, pre_save, post_save):
+    def test_save_signals_update(self, post_save):
         key = 'test'
         Model.create(key=key, foo='bar')
         # Create copies so our in-memory datastore isn't being updated
@@ -88,11 +90,25 @@ class TestModel(object):
         # instance.
         previous = copy.deepcopy(instance)
         instance.foo = 'baz'
-        instance.save()
+        pre_save = Mock()
+        Model.pre_save.connect(pre_save, weak=False)
+        try:
+            instance.save()
+        finally:
+            Model.pre_save.disconnect(pre_save)
         actual_previous = pre_save.call_args[0][0]
         assert_equals(previous.foo, actual_previous.foo)
         assert_true(post_save.called)
 
+    @patch('switchboard.models.Model.pre_save.send')
+    def test_save_update_without_pre_save_receivers(self, pre_save):
+        instance = Model.create(key='test', foo='bar')
+        instance.foo = 'baz'
+        with patch.object(Model, 'get') as get:
+            instance.save()
+            assert_false(get.called)
+        pre_save.assert_called_with(None)
+
     def test_delete(self):
         key = 'test'
         instance = Model.create(key=key)
@@ -213,6 +229,7 @@ class TestModel(object):
         redis = Mock()
         redis.keys.return_value = data.keys()
         redis.get = lambda k: data[k]
+        redis.mget = lambda keys: [data.get(k) for k in keys]
         ds = MockDatastore()
         ds.query = Mock()
         ds.query.side_effect = NotImplementedError
@@ -229,6 +246,27 @@ class TestModel(object):
             assert_true(key in actual_keys,
                         '{0} not among returned keys'.format(key))
 
+    def test_queryless_all_redis_missing_values(self):
+        class MockDatastore(object):
+            pass
+        redis = Mock()
+        redis.keys.return_value = []
+        ds = MockDatastore()
+        ds.query = Mock()
+        ds.query.side_effect = NotImplementedError
+        ds.child_datastore = MockDatastore()
+        ds.child_datastore.serializer = pickle
+        ds._redis = redis
+        Model.ds = ds
+        assert_equals(Model.all(), [])
+        assert_false(redis.mget.called)
+        # A key that disappears between keys() and mget() is skipped.
+        redis.keys.return_value = ['a', 'b']
+        redis.mget.return_value = [pickle.dumps(dict(key='a')), None]
+        models = Model.all()
+        assert_equals([model.key for model in models], ['a'])
+        redis.mget.assert_called_once_with(['a', 'b'])
+
     @raises(NotImplementedError)
     def test_queryless_all_unsupported(self):
         class MockDatastore(object):
@@ -259,6 +297,27 @@ class TestModel(object):
         assert_equals(Model.count(), 0)
 
 
+class TestLazyDatastore(object):
+    def setup(self):
+        self.datastore = datastore.DictDatastore()
+        self.factory = Mock(return_value=self.datastore)
+
+    def teardown(self):
+        reset_datastore()
+
+    def test_not_built_until_used(self):
+        LazyDatastore(self.factory)
+        assert_false(self.factory.called)
+
+    def test_built_once(self):
+        Model.ds = LazyDatastore(self.factory)
+        Model.create(key='test', foo='bar')
+        assert_equals(Model.get('test').foo, 'bar')
+        assert_equals(Model.count(), 1)
+        assert_equals(self.factory.call_count, 1)
+        assert_true(self.datastore.contains(_key('test')))
+
+
 class TestSwitch(object):
     def setup(self):
         self.condition_set = IPAddressConditionSet()